@@ -1,12 +1,22 @@
+import base64
+import gzip
 import os
-import json
 import logging
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timezone
+from functools import lru_cache
 from uuid import uuid4
 
 import azure.functions as func
+import brotli
+import orjson
 import pypyodbc as pyodbc
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, NewConnectionError
+from urllib3.util.retry import Retry
 
 # ✅ アプリ全体のデフォルト認証レベルを anonymous に
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
@@ -26,25 +36,127 @@ if not CONN_STR:
     # 起動時に気づけるようにしておく
     logging.warning("FABRIC_SQL_CONNECTIONSTRING is not set. DB access will fail.")
 
+# 接続はワーカースレッドごとに使い回す（リクエスト毎の TCP/TLS/認証ハンドシェイクを避ける）
+# ※ pypyodbc は import 時点で ODBC の接続プーリングを有効にしている
+_CONN_MAX_IDLE_SECONDS = 60
+_tls = threading.local()
+
+
+def _is_alive(conn) -> bool:
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT 1;")
+            cursor.fetchone()
+        finally:
+            cursor.close()
+        return True
+    except pyodbc.Error:
+        return False
+
+
+def _drop_connection() -> None:
+    conn = getattr(_tls, "conn", None)
+    _tls.conn = None
+    if conn is not None:
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+
+
 def get_connection():
+    """
+    Return the cached connection for the current worker thread, reconnecting when
+    there is none yet or when it fails a liveness ping after sitting idle.
+    """
     if not CONN_STR:
         raise RuntimeError("FABRIC_SQL_CONNECTIONSTRING is not configured.")
-    # 必要に応じて timeout を追加してもOK
-    return pyodbc.connect(CONN_STR)
+    conn = getattr(_tls, "conn", None)
+    now = time.monotonic()
+    if conn is not None and now - _tls.last_used > _CONN_MAX_IDLE_SECONDS and not _is_alive(conn):
+        logging.info("Cached DB connection is dead. Reconnecting.")
+        _drop_connection()
+        conn = None
+    if conn is None:
+        # 必要に応じて timeout を追加してもOK
+        conn = pyodbc.connect(CONN_STR, autocommit=False)
+        _tls.conn = conn
+    _tls.last_used = now
+    return conn
+
+
+def _prime_db_driver() -> None:
+    """
+    Load the ODBC driver and open one connection during worker start-up so the
+    first request does not pay for it. With ODBC pooling enabled, close() hands
+    the connection back to the pool.
+    """
+    if not CONN_STR:
+        return
+    try:
+        pyodbc.connect(CONN_STR).close()
+    except Exception:
+        logging.warning("Failed to prime DB connection at start-up.", exc_info=True)
 
-def query_all(sql: str, params: tuple = ()):
-    with get_connection() as conn:
-        cursor = conn.cursor()
+
+_prime_db_driver()
+
+
+@contextmanager
+def _db_cursor():
+    """
+    Yield a cursor on the cached connection. The transaction is committed on success and
+    rolled back on error, including when a generator such as iter_row_batches is closed early;
+    a connection that cannot even roll back is dropped so the next call reconnects.
+    """
+    # Fabric はスナップショット分離のため、読み取りだけでもトランザクションを閉じておく
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        yield cursor
+        conn.commit()
+    except BaseException:
+        try:
+            conn.rollback()
+        except pyodbc.Error:
+            _drop_connection()
+        raise
+    finally:
+        try:
+            cursor.close()
+        except pyodbc.Error:
+            pass
+
+
+def _fetch_dicts(cursor, limit: int | None = None) -> tuple[list, list]:
+    """
+    Materialize the current result set as (column names, list of row dicts).
+    With limit, at most that many rows are pulled from the driver.
+    """
+    cols = [c[0] for c in cursor.description]
+    raw_rows = cursor.fetchall() if limit is None else cursor.fetchmany(limit)
+    return cols, [dict(zip(cols, row)) for row in raw_rows]
+
+
+def iter_row_batches(sql: str, params: tuple = (), chunk_size: int = 500):
+    """
+    Yield (column names, raw row tuples) per fetchmany(chunk_size) batch so the
+    full result set is never held in memory at once.
+    """
+    with _db_cursor() as cursor:
         cursor.execute(sql, params)
-        cols = [c[0] for c in cursor.description]
-        rows = [dict(zip(cols, row)) for row in cursor.fetchall()]
-    return rows
+        cols = tuple(c[0] for c in cursor.description)
+        while True:
+            batch = cursor.fetchmany(chunk_size)
+            if not batch:
+                break
+            yield cols, batch
+
 
 def execute_non_query(sql: str, params: tuple = ()) -> int:
-    with get_connection() as conn:
-        cursor = conn.cursor()
+    with _db_cursor() as cursor:
         cursor.execute(sql, params)
-        conn.commit()
         return cursor.rowcount
 
 
@@ -53,8 +165,7 @@ def _next_numeric_code(table: str, column: str, default_start: int = 1) -> str:
     Return next numeric code (as string) by incrementing MAX(column) after casting to INT.
     If no numeric rows, start from default_start.
     """
-    with get_connection() as conn:
-        cursor = conn.cursor()
+    with _db_cursor() as cursor:
         cursor.execute(
             f"SELECT MAX(TRY_CAST({column} AS INT)) AS max_code FROM {table};"
         )
@@ -68,11 +179,294 @@ def _next_numeric_code(table: str, column: str, default_start: int = 1) -> str:
 
 
 def _clamp_limit(value, default: int = 200, max_limit: int = 2000) -> int:
-    try:
-        num = int(value)
-    except Exception:
+    # 毎リクエスト通るので、例外を使わずに数字かどうかを判定する
+    if isinstance(value, int):
+        num = value
+    elif isinstance(value, str):
+        text = value.strip()
+        digits = text[1:] if text[:1] in ("-", "+") else text
+        if not digits.isdecimal():
+            return default
+        # 桁数が多すぎると int() が ValueError になる（max_str_digits）ので、変換せずに丸める
+        if len(digits.lstrip("0")) > 9:
+            return 1 if text[:1] == "-" else max_limit
+        num = int(text)
+    else:
         return default
-    return max(1, min(max_limit, num))
+    return 1 if num < 1 else max_limit if num > max_limit else num
+
+
+_TRUTHY = frozenset({"1", "true", "yes", "on", "y"})
+
+
+def _truthy(value) -> bool:
+    return isinstance(value, str) and value.lower() in _TRUTHY
+
+
+def _rows_as_arrays(req: func.HttpRequest) -> bool:
+    # ?row_format=array のときは rows を columns と同じ順序の配列で返す（行ごとの dict を作らない）
+    return req.params.get("row_format") == "array"
+
+
+# ===== keyset ページング =====
+# 一覧 API は ?cursor=<前ページの next_cursor> で続きを取得できる。
+# keyset は (結果の列名, SQL 式, 値の復元関数) のタプルで、ORDER BY と同じ順序・すべて DESC。
+# キー全体で行が一意にならないと、ページ境界で同じキーの残りの行を取りこぼす。
+# カーソルは最終行のキー値を JSON 配列にして base64url で包んだもの（NULL のキーは null のまま持つ）。
+
+def _encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps(values, default=str)).rstrip(b"=").decode()
+
+
+def _parse_cursor(req: func.HttpRequest, keyset: tuple) -> list | None:
+    """
+    Decode ?cursor into the key values of the last row of the previous page.
+    Returns None when no cursor is given and raises ValueError when it is malformed.
+    """
+    token = req.params.get("cursor")
+    if not token:
+        return None
+    try:
+        values = orjson.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor.") from e
+    if not isinstance(values, list) or len(values) != len(keyset):
+        raise ValueError("Invalid cursor.")
+    try:
+        return [
+            decode(value) if decode and value is not None else _cursor_scalar(value)
+            for value, (_, _, decode) in zip(values, keyset)
+        ]
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor.") from e
+
+
+def _cursor_scalar(value):
+    # 復元関数の無いキーは、そのまま DB にバインドできる値だけを受け付ける（bool は int 扱いにしない）
+    if value is None or (type(value) in (str, int, float)):
+        return value
+    raise ValueError("Invalid cursor.")
+
+
+@lru_cache(maxsize=64)
+def _keyset_condition(exprs: tuple, nulls: tuple) -> tuple[str, tuple]:
+    """
+    Expand (k1, k2, ...) < (?, ?, ...) into T-SQL for the given NULL pattern of the
+    cursor values. Returns the condition and, per placeholder, the index of its value.
+    """
+    # SQL Server の DESC では NULL が最後に並ぶので、NULL は「どの値よりも小さい」として扱う。
+    # NULL と比較すると常に偽になるため、NULL のキーは IS NULL で比較する
+    condition, slots = None, ()  # None は「該当する行なし」
+    for i in reversed(range(len(exprs))):
+        expr = exprs[i]
+        if nulls[i]:
+            less, less_slots = None, ()
+            equal, equal_slots = f"{expr} IS NULL", ()
+        else:
+            less, less_slots = f"({expr} < ? OR {expr} IS NULL)", (i,)
+            equal, equal_slots = f"{expr} = ?", (i,)
+        if condition is None:
+            condition, slots = less, less_slots
+            continue
+        tail, tail_slots = f"({equal} AND {condition})", equal_slots + slots
+        if less is None:
+            condition, slots = tail, tail_slots
+        else:
+            condition, slots = f"({less} OR {tail})", less_slots + tail_slots
+    return condition or "1 = 0", slots
+
+
+def _keyset_where(keyset: tuple, values: list | None) -> tuple[str, list]:
+    """Return the WHERE condition and its parameters for rows after values ("" when values is None)."""
+    if values is None:
+        return "", []
+    condition, slots = _keyset_condition(
+        tuple(expr for _, expr, _ in keyset), tuple(value is None for value in values)
+    )
+    return condition, [values[i] for i in slots]
+
+
+def _paged(batches, page: dict):
+    """Pass (cols, rows) batches through, recording the row count and the last row in page."""
+    for cols, rows in batches:
+        page["cols"] = cols
+        page["count"] = page.get("count", 0) + len(rows)
+        page["last"] = rows[-1]
+        yield cols, rows
+
+
+def _next_cursor(page: dict, keyset: tuple, limit: int) -> str | None:
+    # 1 ページぶん埋まったときだけ続きがあるとみなす
+    if page.get("count", 0) < limit:
+        return None
+    cols, last = page["cols"], page["last"]
+    return _encode_cursor([last[cols.index(name)] for name, _, _ in keyset])
+
+
+@lru_cache(maxsize=32)
+def _sql_with_keyset(template: str, condition: str) -> str:
+    # 1 ページ目と 2 ページ目以降で SQL テキストはそれぞれ固定になる
+    return template.format(keyset=f" AND {condition}" if condition else "")
+
+
+def _next_cursor_headers(next_cursor: str | None) -> dict:
+    # 配列を返す API は本文の形を変えないよう、次ページのカーソルをヘッダーで返す。
+    # ブラウザからのクロスオリジン呼び出しでも読めるように Access-Control-Expose-Headers に載せる
+    headers = {"Access-Control-Expose-Headers": "X-Next-Cursor"}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return headers
+
+
+def _dump_json(obj) -> bytes:
+    # Naive datetimes from the DB are emitted as UTC; Decimal / UUID fall back to str.
+    return orjson.dumps(obj, default=str, option=orjson.OPT_NAIVE_UTC)
+
+
+def _rows_to_json_bytes(cols: tuple, rows: list, as_arrays: bool = False) -> bytes:
+    """
+    Encode one batch of row tuples in a single orjson call, as a JSON array of
+    objects or, with as_arrays, as an array of arrays in projection order.
+    """
+    if as_arrays:
+        # pypyodbc の行は tuple のサブクラスで orjson がそのまま扱えない（default=str で repr になる）ので list にする
+        return _dump_json(list(map(list, rows)))
+    return _dump_json([dict(zip(cols, row)) for row in rows])
+
+
+def _json_rows_body(batches, as_arrays: bool = False) -> bytes:
+    """Encode the (cols, rows) batches from iter_row_batches as one JSON array."""
+    # 各バッチの "[...]" から括弧を外してつなげる（空バッチは iter_row_batches が返さない）
+    return (
+        b"["
+        + b",".join(
+            _rows_to_json_bytes(cols, rows, as_arrays)[1:-1] for cols, rows in batches
+        )
+        + b"]"
+    )
+
+
+def _json_table_body(columns: list, rows_body: bytes, next_cursor: str | None) -> bytes:
+    """Wrap an encoded rows array as {"columns": [...], "rows": [...], "next_cursor": ...}."""
+    return (
+        b'{"columns":'
+        + _dump_json(columns)
+        + b',"rows":'
+        + rows_body
+        + b',"next_cursor":'
+        + _dump_json(next_cursor)
+        + b"}"
+    )
+
+
+# これより小さい本文は圧縮しても得にならないのでそのまま返す
+_COMPRESS_MIN_BYTES = 1024
+
+
+def _accepted_encodings(req: func.HttpRequest) -> set:
+    """Return the content codings the client accepts (ignoring those sent with q=0)."""
+    accepted = set()
+    for part in req.headers.get("Accept-Encoding", "").split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        params = params.replace(" ", "").lower()
+        if params.startswith("q=") and params[2:].rstrip("0").rstrip(".") in ("", "0"):
+            continue
+        accepted.add(coding)
+    return accepted
+
+
+def _json_response(
+    payload,
+    status_code: int = 200,
+    req: func.HttpRequest | None = None,
+    headers: dict | None = None,
+) -> func.HttpResponse:
+    """
+    Serialize payload with orjson and wrap it in a JSON HttpResponse.
+    An already-encoded bytes payload is passed through as-is.
+    When req is given, bodies of _COMPRESS_MIN_BYTES or more are compressed with
+    br or gzip according to its Accept-Encoding header.
+    """
+    body = payload if isinstance(payload, bytes) else _dump_json(payload)
+    headers = dict(headers or {})
+    if req is not None:
+        headers["Vary"] = "Accept-Encoding"
+        if len(body) >= _COMPRESS_MIN_BYTES:
+            accepted = _accepted_encodings(req)
+            if "br" in accepted:
+                body = brotli.compress(body, quality=4)
+                headers["Content-Encoding"] = "br"
+            elif "gzip" in accepted:
+                body = gzip.compress(body, compresslevel=1)
+                headers["Content-Encoding"] = "gzip"
+    return func.HttpResponse(
+        body=body,
+        mimetype="application/json",
+        status_code=status_code,
+        headers=headers or None,
+    )
+
+
+def _message_body(message: str) -> bytes:
+    """Encode {"message": message} without building the dict first."""
+    return b'{"message":' + orjson.dumps(message) + b"}"
+
+
+# 固定メッセージのレスポンス本文は import 時にエンコードしておく
+_BODY_CANDIDATE_ACTION_REQUIRED = _message_body("candidate_id and action are required.")
+_BODY_CANDIDATE_NOT_FOUND = _message_body("Candidate not found.")
+_BODY_GENERATE_PARAMS_NOT_NUMBERS = _message_body("sample_size, max_candidates, min_candidates must be numbers.")
+_BODY_INVALID_CURSOR = _message_body("Invalid cursor.")
+_BODY_INVALID_JSON = _message_body("Invalid JSON")
+_BODY_SCORE_ID_REQUIRED = _message_body("score_id is required.")
+_BODY_SCORE_NAME_OR_DESCRIPTION_REQUIRED = _message_body("score_name or description is required.")
+_BODY_SCORE_NAME_REQUIRED = _message_body("score_name is required.")
+_BODY_SCORE_NOT_FOUND = _message_body("Score not found.")
+_BODY_TAG_ID_REQUIRED = _message_body("tag_id is required.")
+_BODY_TAG_NAME_OR_DESCRIPTION_REQUIRED = _message_body("tag_name or description is required.")
+_BODY_TAG_NAME_REQUIRED = _message_body("tag_name is required.")
+_BODY_TAG_NOT_FOUND = _message_body("Tag not found.")
+
+
+# テーブル定義はプロセス存続中ほぼ変わらないので、列名の問い合わせ結果を一定時間キャッシュする
+_COLUMNS_CACHE_TTL_SECONDS = 600
+_columns_cache: dict[str, tuple[float, frozenset]] = {}
+_columns_cache_lock = threading.Lock()
+
+
+def _table_columns(table_name: str) -> frozenset:
+    """
+    Return the column names of table_name, re-reading them from the DB at most
+    once per _COLUMNS_CACHE_TTL_SECONDS.
+    """
+    now = time.monotonic()
+    with _columns_cache_lock:
+        cached = _columns_cache.get(table_name)
+    if cached is not None and now - cached[0] < _COLUMNS_CACHE_TTL_SECONDS:
+        return cached[1]
+
+    with _db_cursor() as cursor:
+        cursor.execute(f"SELECT TOP (0) * FROM {table_name}")
+        columns = frozenset(c[0] for c in cursor.description)
+
+    with _columns_cache_lock:
+        _columns_cache[table_name] = (now, columns)
+    return columns
+
+
+@lru_cache(maxsize=128)
+def _table_select_sql(
+    table_name: str, where_columns: tuple, order_column: str | None
+) -> str:
+    """Build (and cache) the SELECT used by _fetch_table_rows; TOP is bound as a parameter."""
+    where_clause = (
+        f" WHERE {' AND '.join(f'{c} = ?' for c in where_columns)}" if where_columns else ""
+    )
+    order_clause = f" ORDER BY {order_column} DESC" if order_column else ""
+    return f"SELECT TOP (?) * FROM {table_name}{where_clause}{order_clause};"
 
 
 def _fetch_table_rows(
@@ -86,41 +480,35 @@ def _fetch_table_rows(
     limit = _clamp_limit(req.params.get("limit", 200))
     filterable = filterable or {}
 
-    with get_connection() as conn:
-        cursor = conn.cursor()
-
-        cursor.execute(f"SELECT TOP (0) * FROM {table_name}")
-        available_columns = [c[0] for c in cursor.description]
+    available_columns = _table_columns(table_name)
+
+    where_columns = []
+    params = [limit]
+    for query_param, column_name in filterable.items():
+        value = req.params.get(query_param)
+        if value is None:
+            continue
+        if column_name not in available_columns:
+            logging.warning(
+                "Ignoring filter '%s' for table %s because column is missing",
+                column_name,
+                table_name,
+            )
+            continue
+        where_columns.append(column_name)
+        params.append(value)
 
-        where_parts = []
-        params = []
-        for query_param, column_name in filterable.items():
-            value = req.params.get(query_param)
-            if value is None:
-                continue
-            if column_name not in available_columns:
-                logging.warning(
-                    "Ignoring filter '%s' for table %s because column is missing",
-                    column_name,
-                    table_name,
-                )
-                continue
-            where_parts.append(f"{column_name} = ?")
-            params.append(value)
-
-        order_column = None
-        for candidate in ("evaluated_at", "updated_at", "created_at"):
-            if candidate in available_columns:
-                order_column = candidate
-                break
+    order_column = None
+    for candidate in ("evaluated_at", "updated_at", "created_at"):
+        if candidate in available_columns:
+            order_column = candidate
+            break
 
-        where_clause = f" WHERE {' AND '.join(where_parts)}" if where_parts else ""
-        order_clause = f" ORDER BY {order_column} DESC" if order_column else ""
-        sql = f"SELECT TOP ({limit}) * FROM {table_name}{where_clause}{order_clause};"
+    sql = _table_select_sql(table_name, tuple(where_columns), order_column)
 
+    with _db_cursor() as cursor:
         cursor.execute(sql, tuple(params))
-        cols = [c[0] for c in cursor.description]
-        rows = [dict(zip(cols, row)) for row in cursor.fetchall()]
+        cols, rows = _fetch_dicts(cursor, limit)
 
     return {"columns": cols, "rows": rows}
 
@@ -129,54 +517,138 @@ def _fetch_table_rows(
 DEFAULT_TYPE = "behavior_feature"
 DEFAULT_STATUS = "new"
 
+FEATURE_CANDIDATES_PAGE_SIZE = 100
+
+# SQL 文はモジュール定数にしておき、毎回同じテキストでプランキャッシュに載せる
+# （{keyset} には 2 ページ目以降のときだけ keyset 条件が入る）
+_SQL_GET_FEATURE_CANDIDATES = """
+    SELECT TOP (?)
+      candidate_id,
+      type,
+      source,
+      name_proposed,
+      description_proposed,
+      logic_proposed,
+      status,
+      created_at
+    FROM feature_candidates
+    WHERE type = ? AND status = ?{keyset}
+    ORDER BY created_at DESC, candidate_id DESC;
+"""
+_KEYSET_FEATURE_CANDIDATES = (
+    ("created_at", "created_at", datetime.fromisoformat),
+    ("candidate_id", "candidate_id", None),
+)
+
 @app.route(route="getFeatureCandidates", methods=["GET"])
 def get_feature_candidates(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("getFeatureCandidates called")
 
     type_param = req.params.get("type", DEFAULT_TYPE)
     status_param = req.params.get("status", DEFAULT_STATUS)
-
     try:
-        sql = """
-            SELECT TOP (100)
-              candidate_id,
-              type,
-              source,
-              name_proposed,
-              description_proposed,
-              logic_proposed,
-              status,
-              created_at
-            FROM feature_candidates
-            WHERE type = ? AND status = ?
-            ORDER BY created_at DESC;
-        """
+        after = _parse_cursor(req, _KEYSET_FEATURE_CANDIDATES)
+    except ValueError:
+        return _json_response(_BODY_INVALID_CURSOR, 400)
 
-        rows = query_all(sql, (type_param, status_param))
-
-        return func.HttpResponse(
-            body=json.dumps(rows, default=str),
-            mimetype="application/json",
-            status_code=200,
+    try:
+        keyset_sql, keyset_params = _keyset_where(_KEYSET_FEATURE_CANDIDATES, after)
+        sql = _sql_with_keyset(_SQL_GET_FEATURE_CANDIDATES, keyset_sql)
+        page = {}
+        rows = _paged(
+            iter_row_batches(
+                sql, (FEATURE_CANDIDATES_PAGE_SIZE, type_param, status_param, *keyset_params)
+            ),
+            page,
         )
+        body = _json_rows_body(rows)
+        next_cursor = _next_cursor(page, _KEYSET_FEATURE_CANDIDATES, FEATURE_CANDIDATES_PAGE_SIZE)
+
+        return _json_response(body, req=req, headers=_next_cursor_headers(next_cursor))
     except Exception as e:
         logging.exception("getFeatureCandidates error")
-        return func.HttpResponse(
-            body=json.dumps(
-                {
-                    "message": str(e),
-                    "endpoint": "getFeatureCandidates",
-                },
-                default=str,
-            ),
-            mimetype="application/json",
-            status_code=500,
+        return _json_response(
+            {
+                "message": str(e),
+                "endpoint": "getFeatureCandidates",
+            },
+            500,
         )
 
 # ===== POST /api/updateFeatureCandidate =====
 
 VALID_ACTIONS = ("adopt", "reject")
 
+_SQL_UPDATE_CANDIDATE_STATUS = (
+    "UPDATE feature_candidates SET status = ?, updated_at = ? WHERE candidate_id = ?;"
+)
+
+# adopt は UPDATE → マスタテーブルへの INSERT → 存在確認を 1 バッチ（往復 1 回）で実行する。
+# INSERT ... SELECT で候補行を直接コピーするので、SELECT 結果を待ってから INSERT する必要がない
+# （OUTPUT 句は Fabric の SQL エンドポイントによって使えないため、最後の SELECT で存在を確認する）
+# {ids} には候補 ID 数ぶんの "?" が入る。ID はバッチ内で 4 回バインドされるので、
+# SQL Server のパラメータ上限 (2100) に収まるよう 1 バッチあたりの件数を抑える
+_ADOPT_MAX_IDS_PER_BATCH = 500
+_SQL_ADOPT_CANDIDATES_TEMPLATE = """
+    SET NOCOUNT ON;
+    UPDATE feature_candidates SET status = ?, updated_at = ? WHERE candidate_id IN ({ids});
+    INSERT INTO tag_definitions
+      (tag_id, tag_code, tag_name, description, value_type, source_type,
+       is_multi_valued, is_active, created_at, updated_at)
+    SELECT candidate_id, name_proposed, name_proposed, description_proposed, 'string', 'llm',
+           0, 1, ?, ?
+    FROM feature_candidates
+    WHERE candidate_id IN ({ids}) AND type = 'tag';
+    INSERT INTO score_definitions
+      (score_id, score_code, score_name, description, min_value, max_value,
+       direction, source_type, refresh_interval, is_active, created_at, updated_at)
+    SELECT candidate_id, name_proposed, name_proposed, description_proposed, NULL, NULL,
+           'higher_is_better', 'llm', NULL, 1, ?, ?
+    FROM feature_candidates
+    WHERE candidate_id IN ({ids}) AND type = 'score';
+    SELECT candidate_id
+    FROM feature_candidates
+    WHERE candidate_id IN ({ids});
+"""
+
+
+@lru_cache(maxsize=64)
+def _adopt_candidates_sql(count: int) -> str:
+    return _SQL_ADOPT_CANDIDATES_TEMPLATE.format(ids=", ".join("?" * count))
+
+
+def _bulk_adopt(candidate_ids: list[str], now: datetime) -> set:
+    """
+    Mark candidates as adopted and copy them into tag_definitions / score_definitions
+    in one transaction, sending up to _ADOPT_MAX_IDS_PER_BATCH ids per round trip.
+    Returns the ids that exist in feature_candidates.
+    """
+    candidate_ids = list(dict.fromkeys(candidate_ids))  # 重複 ID で二重 INSERT しない
+    adopted = set()
+    with _db_cursor() as cursor:
+        for start in range(0, len(candidate_ids), _ADOPT_MAX_IDS_PER_BATCH):
+            ids = candidate_ids[start:start + _ADOPT_MAX_IDS_PER_BATCH]
+            cursor.execute(
+                _adopt_candidates_sql(len(ids)),
+                ("adopted", now, *ids, now, now, *ids, now, now, *ids, *ids),
+            )
+            adopted.update(row[0] for row in cursor.fetchall())
+    return adopted
+
+_SQL_INSERT_TAG_DEFINITION = """
+    INSERT INTO tag_definitions
+      (tag_id, tag_code, tag_name, description, value_type, source_type,
+       is_multi_valued, is_active, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+
+_SQL_INSERT_SCORE_DEFINITION = """
+    INSERT INTO score_definitions
+      (score_id, score_code, score_name, description, min_value, max_value,
+       direction, source_type, refresh_interval, is_active, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+
 @app.route(route="updateFeatureCandidate", methods=["POST"])
 def update_feature_candidate(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("updateFeatureCandidate called")
@@ -185,194 +657,127 @@ def update_feature_candidate(req: func.HttpRequest) -> func.HttpResponse:
     try:
         payload = req.get_json()
     except:
-        return func.HttpResponse(
-            json.dumps({"message": "Invalid JSON"}),
-            mimetype="application/json",
-            status_code=400,
-        )
+        return _json_response(_BODY_INVALID_JSON, 400)
 
     candidate_id = payload.get("candidate_id")
     action = payload.get("action")
     if not candidate_id or action not in ("adopt", "reject"):
-        return func.HttpResponse(
-            json.dumps({"message": "candidate_id and action are required."}),
-            mimetype="application/json",
-            status_code=400,
-        )
+        return _json_response(_BODY_CANDIDATE_ACTION_REQUIRED, 400)
 
     next_status = "adopted" if action == "adopt" else "rejected"
     now = datetime.now(tz=timezone.utc)
 
     try:
-        # --- 1) Update status ---
-        sql = "UPDATE feature_candidates SET status = ?, updated_at = ? WHERE candidate_id = ?;"
-        execute_non_query(sql, (next_status, now, candidate_id))
-
         if next_status != "adopted":
-            return func.HttpResponse(
-                json.dumps({"candidate_id": candidate_id, "status": next_status}),
-                mimetype="application/json",
-                status_code=200,
-            )
-
-        # --- 2) SELECT adopted candidate ---
-        candidate_sql = """
-            SELECT candidate_id, type, name_proposed, description_proposed
-            FROM feature_candidates
-            WHERE candidate_id = ?;
-        """
-        rows = query_all(candidate_sql, (candidate_id,))
-        if not rows:
-            return func.HttpResponse(
-                json.dumps({"message": "Candidate not found."}),
-                mimetype="application/json",
-                status_code=404,
-            )
-        c = rows[0]
-
-        # --- 3) Insert into proper master table ---
-        if c["type"] == "tag":
-            insert_sql = """
-                INSERT INTO tag_definitions
-                  (tag_id, tag_code, tag_name, description, value_type, source_type,
-                   is_multi_valued, is_active, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
-            """
-            params = (
-                c["candidate_id"],
-                c["name_proposed"],
-                c["name_proposed"],
-                c["description_proposed"],
-                "string",
-                "llm",
-                0,
-                1,
-                now,
-                now,
-            )
+            execute_non_query(_SQL_UPDATE_CANDIDATE_STATUS, (next_status, now, candidate_id))
+            return _json_response({"candidate_id": candidate_id, "status": next_status})
 
-            execute_non_query(insert_sql, params)
-
-        elif c["type"] == "score":
-            insert_sql = """
-                INSERT INTO score_definitions
-                  (score_id, score_code, score_name, description, min_value, max_value,
-                   direction, source_type, refresh_interval, is_active, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
-            """
-            params = (
-                c["candidate_id"],
-                c["name_proposed"],
-                c["name_proposed"],
-                c["description_proposed"],
-                None,
-                None,
-                "higher_is_better",
-                "llm",
-                None,
-                1,
-                now,
-                now,
-            )
-
-            execute_non_query(insert_sql, params)
+        # --- 1) Update status + 2) Insert into proper master table + 3) 存在確認（1 バッチ） ---
+        if candidate_id not in _bulk_adopt([candidate_id], now):
+            return _json_response(_BODY_CANDIDATE_NOT_FOUND, 404)
 
         # --- 4) return response ---
-        return func.HttpResponse(
-            json.dumps({"candidate_id": candidate_id, "status": next_status}),
-            mimetype="application/json",
-            status_code=200,
-        )
+        return _json_response({"candidate_id": candidate_id, "status": next_status})
 
     except Exception as e:
         logging.exception("updateFeatureCandidate error")
-        return func.HttpResponse(
-            json.dumps({"message": str(e)}),
-            mimetype="application/json",
-            status_code=500,
-        )
+        return _json_response(_message_body(str(e)), 500)
 
 # ===== GET /api/getTagDefinitions =====
 
+# include_inactive は 2 つ目のパラメータ (1/0) で切り替え、SQL テキストを 1 つに保つ
+_SQL_GET_TAG_DEFINITIONS = """
+    SELECT TOP (?)
+      tag_id,
+      tag_name,
+      description,
+      created_at
+    FROM tag_definitions
+    WHERE (is_active = 1 OR ? = 1){keyset}
+    ORDER BY created_at DESC, tag_id DESC;
+"""
+_KEYSET_TAG_DEFINITIONS = (
+    ("created_at", "created_at", datetime.fromisoformat),
+    ("tag_id", "tag_id", None),
+)
+
 @app.route(route="getTagDefinitions", methods=["GET"])
 def get_tag_definitions(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("getTagDefinitions called")
 
-    include_inactive = (
-        str(req.params.get("include_inactive", "false")).lower() in ("1", "true", "yes")
-    )
+    include_inactive = _truthy(req.params.get("include_inactive"))
     limit = _clamp_limit(req.params.get("limit", 200))
+    try:
+        after = _parse_cursor(req, _KEYSET_TAG_DEFINITIONS)
+    except ValueError:
+        return _json_response(_BODY_INVALID_CURSOR, 400)
 
     try:
-        where_clause = "" if include_inactive else "WHERE is_active = 1"
-        sql = f"""
-            SELECT TOP ({limit})
-              tag_id,
-              tag_name,
-              description,
-              created_at
-            FROM tag_definitions
-            {where_clause}
-            ORDER BY created_at DESC;
-        """
-        rows = query_all(sql)
-        return func.HttpResponse(
-            body=json.dumps(rows, default=str),
-            mimetype="application/json",
-            status_code=200,
+        keyset_sql, keyset_params = _keyset_where(_KEYSET_TAG_DEFINITIONS, after)
+        sql = _sql_with_keyset(_SQL_GET_TAG_DEFINITIONS, keyset_sql)
+        page = {}
+        rows = _paged(
+            iter_row_batches(sql, (limit, 1 if include_inactive else 0, *keyset_params)),
+            page,
         )
+        body = _json_rows_body(rows)
+        next_cursor = _next_cursor(page, _KEYSET_TAG_DEFINITIONS, limit)
+        return _json_response(body, req=req, headers=_next_cursor_headers(next_cursor))
     except Exception as e:
         logging.exception("getTagDefinitions error")
-        return func.HttpResponse(
-            json.dumps({"message": str(e)}),
-            mimetype="application/json",
-            status_code=500,
-        )
+        return _json_response(_message_body(str(e)), 500)
 
 # ===== GET /api/getScoreDefinitions =====
 
+_SQL_GET_SCORE_DEFINITIONS = """
+    SELECT TOP (?)
+      score_id,
+      score_code,
+      score_name,
+      description,
+      min_value,
+      max_value,
+      direction,
+      source_type,
+      refresh_interval,
+      is_active,
+      created_at,
+      updated_at
+    FROM score_definitions
+    WHERE (is_active = 1 OR ? = 1){keyset}
+    ORDER BY updated_at DESC, created_at DESC, score_id DESC;
+"""
+_KEYSET_SCORE_DEFINITIONS = (
+    ("updated_at", "updated_at", datetime.fromisoformat),
+    ("created_at", "created_at", datetime.fromisoformat),
+    ("score_id", "score_id", None),
+)
+
 @app.route(route="getScoreDefinitions", methods=["GET"])
 def get_score_definitions(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("getScoreDefinitions called")
 
-    include_inactive = (
-        str(req.params.get("include_inactive", "false")).lower() in ("1", "true", "yes")
-    )
+    include_inactive = _truthy(req.params.get("include_inactive"))
     limit = _clamp_limit(req.params.get("limit", 200))
+    try:
+        after = _parse_cursor(req, _KEYSET_SCORE_DEFINITIONS)
+    except ValueError:
+        return _json_response(_BODY_INVALID_CURSOR, 400)
 
     try:
-        where_clause = "" if include_inactive else "WHERE is_active = 1"
-        sql = f"""
-            SELECT TOP ({limit})
-              score_id,
-              score_code,
-              score_name,
-              description,
-              min_value,
-              max_value,
-              direction,
-              source_type,
-              refresh_interval,
-              is_active,
-              created_at,
-              updated_at
-            FROM score_definitions
-            {where_clause}
-            ORDER BY updated_at DESC, created_at DESC;
-        """
-        rows = query_all(sql)
-        return func.HttpResponse(
-            body=json.dumps(rows, default=str),
-            mimetype="application/json",
-            status_code=200,
+        keyset_sql, keyset_params = _keyset_where(_KEYSET_SCORE_DEFINITIONS, after)
+        sql = _sql_with_keyset(_SQL_GET_SCORE_DEFINITIONS, keyset_sql)
+        page = {}
+        rows = _paged(
+            iter_row_batches(sql, (limit, 1 if include_inactive else 0, *keyset_params)),
+            page,
         )
+        body = _json_rows_body(rows)
+        next_cursor = _next_cursor(page, _KEYSET_SCORE_DEFINITIONS, limit)
+        return _json_response(body, req=req, headers=_next_cursor_headers(next_cursor))
     except Exception as e:
         logging.exception("getScoreDefinitions error")
-        return func.HttpResponse(
-            json.dumps({"message": str(e)}),
-            mimetype="application/json",
-            status_code=500,
-        )
+        return _json_response(_message_body(str(e)), 500)
 
 # ===== POST /api/createTagDefinition =====
 
@@ -383,25 +788,17 @@ def _parse_json_body(req: func.HttpRequest) -> dict | None:
         return None
 
 
-def _json_response(payload: dict, status_code: int = 200) -> func.HttpResponse:
-    return func.HttpResponse(
-        body=json.dumps(payload, default=str),
-        mimetype="application/json",
-        status_code=status_code,
-    )
-
-
 @app.route(route="createTagDefinition", methods=["POST"])
 def create_tag_definition(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("createTagDefinition called")
 
     payload = _parse_json_body(req)
     if payload is None:
-        return _json_response({"message": "Invalid JSON"}, 400)
+        return _json_response(_BODY_INVALID_JSON, 400)
 
     tag_name = (payload.get("tag_name") or "").strip()
     if not tag_name:
-        return _json_response({"message": "tag_name is required."}, 400)
+        return _json_response(_BODY_TAG_NAME_REQUIRED, 400)
 
     tag_code = (payload.get("tag_code") or tag_name).strip()
     description = payload.get("description")
@@ -417,12 +814,6 @@ def create_tag_definition(req: func.HttpRequest) -> func.HttpResponse:
     now = datetime.now(tz=timezone.utc)
 
     try:
-        sql = """
-            INSERT INTO tag_definitions
-              (tag_id, tag_code, tag_name, description, value_type, source_type,
-               is_multi_valued, is_active, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
-        """
         params = (
             tag_id,
             tag_code,
@@ -435,7 +826,7 @@ def create_tag_definition(req: func.HttpRequest) -> func.HttpResponse:
             now,
             now,
         )
-        execute_non_query(sql, params)
+        execute_non_query(_SQL_INSERT_TAG_DEFINITION, params)
 
         return _json_response(
             {
@@ -449,7 +840,7 @@ def create_tag_definition(req: func.HttpRequest) -> func.HttpResponse:
         )
     except Exception as e:
         logging.exception("createTagDefinition error")
-        return _json_response({"message": str(e)}, 500)
+        return _json_response(_message_body(str(e)), 500)
 
 
 # ===== POST /api/updateTagDefinition =====
@@ -460,16 +851,16 @@ def update_tag_definition(req: func.HttpRequest) -> func.HttpResponse:
 
     payload = _parse_json_body(req)
     if payload is None:
-        return _json_response({"message": "Invalid JSON"}, 400)
+        return _json_response(_BODY_INVALID_JSON, 400)
 
     tag_id = payload.get("tag_id")
     if not tag_id:
-        return _json_response({"message": "tag_id is required."}, 400)
+        return _json_response(_BODY_TAG_ID_REQUIRED, 400)
 
     tag_name = payload.get("tag_name")
     description = payload.get("description")
     if tag_name is None and description is None:
-        return _json_response({"message": "tag_name or description is required."}, 400)
+        return _json_response(_BODY_TAG_NAME_OR_DESCRIPTION_REQUIRED, 400)
 
     now = datetime.now(tz=timezone.utc)
 
@@ -483,12 +874,12 @@ def update_tag_definition(req: func.HttpRequest) -> func.HttpResponse:
         """
         updated = execute_non_query(sql, (tag_name, description, now, tag_id))
         if updated == 0:
-            return _json_response({"message": "Tag not found."}, 404)
+            return _json_response(_BODY_TAG_NOT_FOUND, 404)
 
         return _json_response({"tag_id": tag_id, "tag_name": tag_name, "description": description})
     except Exception as e:
         logging.exception("updateTagDefinition error")
-        return _json_response({"message": str(e)}, 500)
+        return _json_response(_message_body(str(e)), 500)
 
 
 # ===== POST /api/deleteTagDefinition =====
@@ -499,11 +890,11 @@ def delete_tag_definition(req: func.HttpRequest) -> func.HttpResponse:
 
     payload = _parse_json_body(req)
     if payload is None:
-        return _json_response({"message": "Invalid JSON"}, 400)
+        return _json_response(_BODY_INVALID_JSON, 400)
 
     tag_id = payload.get("tag_id")
     if not tag_id:
-        return _json_response({"message": "tag_id is required."}, 400)
+        return _json_response(_BODY_TAG_ID_REQUIRED, 400)
 
     now = datetime.now(tz=timezone.utc)
 
@@ -516,12 +907,12 @@ def delete_tag_definition(req: func.HttpRequest) -> func.HttpResponse:
         """
         updated = execute_non_query(sql, (now, tag_id))
         if updated == 0:
-            return _json_response({"message": "Tag not found."}, 404)
+            return _json_response(_BODY_TAG_NOT_FOUND, 404)
 
         return _json_response({"tag_id": tag_id, "status": "deleted"})
     except Exception as e:
         logging.exception("deleteTagDefinition error")
-        return _json_response({"message": str(e)}, 500)
+        return _json_response(_message_body(str(e)), 500)
 
 
 # ===== POST /api/createScoreDefinition =====
@@ -532,11 +923,11 @@ def create_score_definition(req: func.HttpRequest) -> func.HttpResponse:
 
     payload = _parse_json_body(req)
     if payload is None:
-        return _json_response({"message": "Invalid JSON"}, 400)
+        return _json_response(_BODY_INVALID_JSON, 400)
 
     score_name = (payload.get("score_name") or "").strip()
     if not score_name:
-        return _json_response({"message": "score_name is required."}, 400)
+        return _json_response(_BODY_SCORE_NAME_REQUIRED, 400)
 
     score_code = (payload.get("score_code") or score_name).strip()
     description = payload.get("description")
@@ -554,12 +945,6 @@ def create_score_definition(req: func.HttpRequest) -> func.HttpResponse:
     now = datetime.now(tz=timezone.utc)
 
     try:
-        sql = """
-            INSERT INTO score_definitions
-              (score_id, score_code, score_name, description, min_value, max_value,
-               direction, source_type, refresh_interval, is_active, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
-        """
         params = (
             score_id,
             score_code,
@@ -574,7 +959,7 @@ def create_score_definition(req: func.HttpRequest) -> func.HttpResponse:
             now,
             now,
         )
-        execute_non_query(sql, params)
+        execute_non_query(_SQL_INSERT_SCORE_DEFINITION, params)
 
         return _json_response(
             {
@@ -588,7 +973,7 @@ def create_score_definition(req: func.HttpRequest) -> func.HttpResponse:
         )
     except Exception as e:
         logging.exception("createScoreDefinition error")
-        return _json_response({"message": str(e)}, 500)
+        return _json_response(_message_body(str(e)), 500)
 
 
 # ===== POST /api/updateScoreDefinition =====
@@ -599,16 +984,16 @@ def update_score_definition(req: func.HttpRequest) -> func.HttpResponse:
 
     payload = _parse_json_body(req)
     if payload is None:
-        return _json_response({"message": "Invalid JSON"}, 400)
+        return _json_response(_BODY_INVALID_JSON, 400)
 
     score_id = payload.get("score_id")
     if not score_id:
-        return _json_response({"message": "score_id is required."}, 400)
+        return _json_response(_BODY_SCORE_ID_REQUIRED, 400)
 
     score_name = payload.get("score_name")
     description = payload.get("description")
     if score_name is None and description is None:
-        return _json_response({"message": "score_name or description is required."}, 400)
+        return _json_response(_BODY_SCORE_NAME_OR_DESCRIPTION_REQUIRED, 400)
 
     now = datetime.now(tz=timezone.utc)
 
@@ -622,12 +1007,12 @@ def update_score_definition(req: func.HttpRequest) -> func.HttpResponse:
         """
         updated = execute_non_query(sql, (score_name, description, now, score_id))
         if updated == 0:
-            return _json_response({"message": "Score not found."}, 404)
+            return _json_response(_BODY_SCORE_NOT_FOUND, 404)
 
         return _json_response({"score_id": score_id, "score_name": score_name, "description": description})
     except Exception as e:
         logging.exception("updateScoreDefinition error")
-        return _json_response({"message": str(e)}, 500)
+        return _json_response(_message_body(str(e)), 500)
 
 
 # ===== POST /api/deleteScoreDefinition =====
@@ -638,11 +1023,11 @@ def delete_score_definition(req: func.HttpRequest) -> func.HttpResponse:
 
     payload = _parse_json_body(req)
     if payload is None:
-        return _json_response({"message": "Invalid JSON"}, 400)
+        return _json_response(_BODY_INVALID_JSON, 400)
 
     score_id = payload.get("score_id")
     if not score_id:
-        return _json_response({"message": "score_id is required."}, 400)
+        return _json_response(_BODY_SCORE_ID_REQUIRED, 400)
 
     now = datetime.now(tz=timezone.utc)
 
@@ -655,19 +1040,33 @@ def delete_score_definition(req: func.HttpRequest) -> func.HttpResponse:
         """
         updated = execute_non_query(sql, (now, score_id))
         if updated == 0:
-            return _json_response({"message": "Score not found."}, 404)
+            return _json_response(_BODY_SCORE_NOT_FOUND, 404)
 
         return _json_response({"score_id": score_id, "status": "deleted"})
     except Exception as e:
         logging.exception("deleteScoreDefinition error")
-        return _json_response({"message": str(e)}, 500)
+        return _json_response(_message_body(str(e)), 500)
 
 # ===== GET /api/getAccountTags =====
 
+_KEYSET_ACCOUNT_TAGS = (
+    ("created_at", "at.created_at", datetime.fromisoformat),
+    ("account_id", "at.account_id", None),
+    ("tag_id", "at.tag_id", None),
+    # 複数値タグは同じ企業・タグ・時刻に複数行あるので、値まで含めて行を一意にする
+    ("tag_value", "at.tag_value", None),
+)
+
+
 @app.route(route="getAccountTags", methods=["GET"])
 def get_account_tags(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("getAccountTags called")
 
+    try:
+        after = _parse_cursor(req, _KEYSET_ACCOUNT_TAGS)
+    except ValueError:
+        return _json_response(_BODY_INVALID_CURSOR, 400)
+
     try:
         limit = _clamp_limit(req.params.get("limit", 200))
         account_id = req.params.get("account_id")
@@ -676,7 +1075,7 @@ def get_account_tags(req: func.HttpRequest) -> func.HttpResponse:
         tag_name = req.params.get("tag_name")
 
         where_parts = []
-        params = []
+        params = [limit]
         if account_id:
             where_parts.append("at.account_id = ?")
             params.append(account_id)
@@ -689,58 +1088,72 @@ def get_account_tags(req: func.HttpRequest) -> func.HttpResponse:
         if tag_name:
             where_parts.append("td.tag_name LIKE ?")
             params.append(f"%{tag_name}%")
+        if after is not None:
+            keyset_sql, keyset_params = _keyset_where(_KEYSET_ACCOUNT_TAGS, after)
+            where_parts.append(keyset_sql)
+            params.extend(keyset_params)
 
         where_clause = f"WHERE {' AND '.join(where_parts)}" if where_parts else ""
 
+        # 射影は columns と同じ 7 列・同じ順序に揃える（row_format=array の配列はこの順序になる）。
+        # Fabric Warehouse では非クラスター化索引も索引ヒントも使えないので、SQL 側では何も指定しない。
+        # account_id / tag_id 指定時の読み取りを減らしたい場合は、索引ではなく account_tags を
+        # account_id / tag_id でデータクラスタリングする（またはその順序でロードする）
         sql = f"""
-            SELECT TOP ({limit})
-              at.account_id,
-              at.tag_id,
+            SELECT TOP (?)
+              a.[企業名] AS account_name,
+              td.tag_name,
               at.tag_value,
               at.confidence_score,
               at.created_at,
-              a.[企業名] AS account_name,
-              td.tag_name
+              at.account_id,
+              at.tag_id
             FROM account_tags AS at
             LEFT JOIN tag_definitions AS td ON at.tag_id = td.tag_id
             LEFT JOIN account AS a ON at.account_id = a.[企業ID]
             {where_clause}
-            ORDER BY at.created_at DESC;
+            ORDER BY at.created_at DESC, at.account_id DESC, at.tag_id DESC, at.tag_value DESC;
         """
 
-        rows = query_all(sql, tuple(params))
-        payload = {
-            "columns": [
-                "account_name",
-                "tag_name",
-                "tag_value",
-                "confidence_score",
-                "created_at",
-                "account_id",
-                "tag_id",
-            ],
-            "rows": rows,
-        }
-        return func.HttpResponse(
-            body=json.dumps(payload, default=str),
-            mimetype="application/json",
-            status_code=200,
-        )
+        page = {}
+        rows = _paged(iter_row_batches(sql, tuple(params)), page)
+        columns = [
+            "account_name",
+            "tag_name",
+            "tag_value",
+            "confidence_score",
+            "created_at",
+            "account_id",
+            "tag_id",
+        ]
+        body = _json_rows_body(rows, _rows_as_arrays(req))
+        next_cursor = _next_cursor(page, _KEYSET_ACCOUNT_TAGS, limit)
+        return _json_response(_json_table_body(columns, body, next_cursor), req=req)
     except Exception as e:
         logging.exception("getAccountTags error")
-        return func.HttpResponse(
-            json.dumps({"message": str(e)}),
-            mimetype="application/json",
-            status_code=500,
-        )
+        return _json_response(_message_body(str(e)), 500)
 
 
 # ===== GET /api/getAccountScores =====
 
+_KEYSET_ACCOUNT_SCORES = (
+    ("evaluated_at", "ascore.created_at", datetime.fromisoformat),
+    ("account_id", "ascore.account_id", None),
+    ("score_id", "ascore.score_id", None),
+    # 同じ時刻に同じスコアが重複して書かれても行を取りこぼさないよう、値まで含める
+    ("score_value", "ascore.score_value", None),
+)
+
+
 @app.route(route="getAccountScores", methods=["GET"])
 def get_account_scores(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("getAccountScores called")
 
+    try:
+        after = _parse_cursor(req, _KEYSET_ACCOUNT_SCORES)
+    except ValueError:
+        return _json_response(_BODY_INVALID_CURSOR, 400)
+
     try:
         limit = _clamp_limit(req.params.get("limit", 200))
         account_id = req.params.get("account_id")
@@ -749,7 +1162,7 @@ def get_account_scores(req: func.HttpRequest) -> func.HttpResponse:
         score_name = req.params.get("score_name")
 
         where_parts = []
-        params = []
+        params = [limit]
         if account_id:
             where_parts.append("ascore.account_id = ?")
             params.append(account_id)
@@ -762,11 +1175,16 @@ def get_account_scores(req: func.HttpRequest) -> func.HttpResponse:
         if score_name:
             where_parts.append("sd.score_name LIKE ?")
             params.append(f"%{score_name}%")
+        if after is not None:
+            keyset_sql, keyset_params = _keyset_where(_KEYSET_ACCOUNT_SCORES, after)
+            where_parts.append(keyset_sql)
+            params.extend(keyset_params)
 
         where_clause = f"WHERE {' AND '.join(where_parts)}" if where_parts else ""
 
+        # row_format=array の配列は射影の順序になるので、columns と同じ順序を保つ
         sql = f"""
-            SELECT TOP ({limit})
+            SELECT TOP (?)
               a.[企業名] AS account_name,
               sd.score_name,
               ascore.score_value,
@@ -778,34 +1196,28 @@ def get_account_scores(req: func.HttpRequest) -> func.HttpResponse:
             LEFT JOIN score_definitions AS sd ON ascore.score_id = sd.score_id
             LEFT JOIN account AS a ON ascore.account_id = a.[企業ID]
             {where_clause}
-            ORDER BY ascore.created_at DESC;
+            ORDER BY
+              ascore.created_at DESC, ascore.account_id DESC, ascore.score_id DESC,
+              ascore.score_value DESC;
         """
 
-        rows = query_all(sql, tuple(params))
-        payload = {
-            "columns": [
-                "account_name",
-                "score_name",
-                "score_value",
-                "confidence_score",
-                "evaluated_at",
-                "account_id",
-                "score_id",
-            ],
-            "rows": rows,
-        }
-        return func.HttpResponse(
-            body=json.dumps(payload, default=str),
-            mimetype="application/json",
-            status_code=200,
-        )
+        page = {}
+        rows = _paged(iter_row_batches(sql, tuple(params)), page)
+        columns = [
+            "account_name",
+            "score_name",
+            "score_value",
+            "confidence_score",
+            "evaluated_at",
+            "account_id",
+            "score_id",
+        ]
+        body = _json_rows_body(rows, _rows_as_arrays(req))
+        next_cursor = _next_cursor(page, _KEYSET_ACCOUNT_SCORES, limit)
+        return _json_response(_json_table_body(columns, body, next_cursor), req=req)
     except Exception as e:
         logging.exception("getAccountScores error")
-        return func.HttpResponse(
-            json.dumps({"message": str(e)}),
-            mimetype="application/json",
-            status_code=500,
-        )
+        return _json_response(_message_body(str(e)), 500)
 
 
 # ===== POST /api/generateTagCandidates =====
@@ -814,10 +1226,28 @@ DEFAULT_SAMPLE_SIZE = 1000
 DEFAULT_MAX_CANDIDATES = 10
 DEFAULT_MIN_CANDIDATES = 3
 
+# Entra ID / Fabric API への呼び出しは Session を使い回して keep-alive させる
+# Retry は urllib3 の既定どおり POST を接続失敗時のみ再送する（ノートブックを二重起動しない）
+_HTTP = requests.Session()
+_HTTP.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.2),
+    ),
+)
+
+# アクセストークンは有効期限（expires_in）の少し手前までメモリ上で使い回す
+_TOKEN_REFRESH_MARGIN_SECONDS = 60
+_token_cache = {"token": None, "exp": 0.0}
+_token_lock = threading.Lock()
+
 def _get_fabric_access_token() -> str:
     """
     Azure AD (Entra ID) の client_credentials フローで
     Fabric API 用のアクセストークンを取得するヘルパー。
+    取得したトークンは期限切れ直前までキャッシュする。
     """
     if not FABRIC_TENANT_ID:
         raise RuntimeError("FABRIC_TENANT_ID is not set.")
@@ -826,6 +1256,13 @@ def _get_fabric_access_token() -> str:
     if not FABRIC_CLIENT_SECRET:
         raise RuntimeError("FABRIC_CLIENT_SECRET is not set.")
 
+    with _token_lock:
+        if _token_cache["token"] and time.time() < _token_cache["exp"] - _TOKEN_REFRESH_MARGIN_SECONDS:
+            return _token_cache["token"]
+        return _request_fabric_access_token()
+
+def _request_fabric_access_token() -> str:
+    """Run the token request and refresh _token_cache. Caller must hold _token_lock."""
     token_url = f"https://login.microsoftonline.com/{FABRIC_TENANT_ID}/oauth2/v2.0/token"
     data = {
         "client_id": FABRIC_CLIENT_ID,
@@ -834,7 +1271,7 @@ def _get_fabric_access_token() -> str:
         "scope": "https://api.fabric.microsoft.com/.default",
     }
 
-    resp = requests.post(token_url, data=data, timeout=10)
+    resp = _HTTP.post(token_url, data=data, timeout=10)
     if not resp.ok:
         logging.error(
             "Failed to obtain Fabric access token. status=%s, body=%s",
@@ -855,6 +1292,13 @@ def _get_fabric_access_token() -> str:
     if not access_token:
         raise RuntimeError("access_token is missing in token response.")
 
+    try:
+        expires_in = int(token_json.get("expires_in", 3600))
+    except (TypeError, ValueError):
+        expires_in = 3600
+    _token_cache["token"] = access_token
+    _token_cache["exp"] = time.time() + expires_in
+
     return access_token
 
 def _call_fabric_notebook(payload: dict):
@@ -874,14 +1318,32 @@ def _call_fabric_notebook(payload: dict):
         "Content-Type": "application/json",
     }
 
-    resp = requests.post(trigger_url, json=payload, headers=headers, timeout=30)
+    resp = _HTTP.post(trigger_url, json=payload, headers=headers, timeout=30)
     return resp
 
 
+# ノートブックの起動はキュー経由で dispatch_fabric_notebook に任せ、HTTP ワーカーを待たせない
+GENERATE_TAG_CANDIDATES_QUEUE = "generate-tag-candidates"
+
+_FABRIC_SETTINGS = {
+    "FABRIC_WORKSPACE_ID": FABRIC_WORKSPACE_ID,
+    "FABRIC_ARTIFACT_ID": FABRIC_ARTIFACT_ID,
+    "FABRIC_TENANT_ID": FABRIC_TENANT_ID,
+    "FABRIC_CLIENT_ID": FABRIC_CLIENT_ID,
+    "FABRIC_CLIENT_SECRET": FABRIC_CLIENT_SECRET,
+}
+
+
 @app.route(route="generateTagCandidates", methods=["POST"])
-def generate_tag_candidates(req: func.HttpRequest) -> func.HttpResponse:
+@app.queue_output(
+    arg_name="msg",
+    queue_name=GENERATE_TAG_CANDIDATES_QUEUE,
+    connection="AzureWebJobsStorage",
+)
+def generate_tag_candidates(req: func.HttpRequest, msg: func.Out[str]) -> func.HttpResponse:
     """
-    Trigger Fabric Notebook to generate tag candidates.
+    Queue a request to trigger the Fabric Notebook that generates tag candidates
+    and return 202 right away; dispatch_fabric_notebook performs the actual call.
     The notebook side should read account/appointment tables and insert records into feature_candidates.
     """
     logging.info("generateTagCandidates called")
@@ -896,11 +1358,7 @@ def generate_tag_candidates(req: func.HttpRequest) -> func.HttpResponse:
         max_candidates = max(1, min(10, int(payload.get("max_candidates", DEFAULT_MAX_CANDIDATES))))
         min_candidates = max(1, min(max_candidates, int(payload.get("min_candidates", DEFAULT_MIN_CANDIDATES))))
     except Exception:
-        return func.HttpResponse(
-            json.dumps({"message": "sample_size, max_candidates, min_candidates must be numbers."}),
-            mimetype="application/json",
-            status_code=400,
-        )
+        return _json_response(_BODY_GENERATE_PARAMS_NOT_NUMBERS, 400)
 
     notebook_payload = {
         "sample_size": sample_size,
@@ -912,37 +1370,112 @@ def generate_tag_candidates(req: func.HttpRequest) -> func.HttpResponse:
         if k not in notebook_payload:
             notebook_payload[k] = v
 
-    try:
-        resp = _call_fabric_notebook(notebook_payload)
-        if resp.status_code not in (200, 201, 202):
-            return func.HttpResponse(
-                json.dumps(
-                    {
-                        "message": "Failed to trigger Fabric notebook.",
-                        "status_code": resp.status_code,
-                        "response": resp.text,
-                    }
-                ),
-                mimetype="application/json",
-                status_code=502,
-            )
+    # 設定漏れはキューに積む前に気づけるようにする
+    missing = [name for name, value in _FABRIC_SETTINGS.items() if not value]
+    if missing:
+        return _json_response(_message_body(f"{', '.join(missing)} is not set."), 500)
 
-        return func.HttpResponse(
-            json.dumps(
-                {
-                    "message": "Fabric notebook triggered.",
-                    "upstream_status": resp.status_code,
-                    "upstream_response": resp.text,
-                }
-            ),
-            mimetype="application/json",
-            status_code=200,
+    try:
+        msg.set(_dump_json(notebook_payload).decode())
+        return _json_response(
+            {
+                "message": "Fabric notebook trigger queued.",
+                "parameters": notebook_payload,
+            },
+            202,
         )
 
     except Exception as e:
         logging.exception("generateTagCandidates error")
-        return func.HttpResponse(
-            json.dumps({"message": str(e)}),
-            mimetype="application/json",
-            status_code=500,
+        return _json_response(_message_body(str(e)), 500)
+
+
+def _trigger_not_sent(exc: requests.ConnectionError) -> bool:
+    # 接続を確立する前に失敗したときだけ True（送信後に切断された ProtocolError などは含めない）
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = exc.args[0] if exc.args else None
+    return isinstance(reason, MaxRetryError) and isinstance(
+        reason.reason, (NewConnectionError, ConnectTimeoutError)
+    )
+
+
+# ゲートウェイのエラーは Fabric 側でジョブが作られたかどうか分からない
+_AMBIGUOUS_TRIGGER_STATUSES = frozenset((502, 504))
+
+
+@app.queue_trigger(
+    arg_name="msg",
+    queue_name=GENERATE_TAG_CANDIDATES_QUEUE,
+    connection="AzureWebJobsStorage",
+)
+def dispatch_fabric_notebook(msg: func.QueueMessage) -> None:
+    """
+    Trigger the Fabric Notebook for a message queued by generateTagCandidates.
+    Failures that happen before the request reaches Fabric, 429 and 5xx other than
+    502/504 raise so the queue retries the message; ambiguous outcomes and other
+    rejections are logged and dropped so the notebook is never started twice.
+    """
+    logging.info("dispatch_fabric_notebook called")
+
+    notebook_payload = msg.get_json()
+    # トークン取得はジョブ起動より前なので、ここでの失敗は再試行してよい
+    _get_fabric_access_token()
+    try:
+        resp = _call_fabric_notebook(notebook_payload)
+    except requests.ConnectionError as e:
+        if _trigger_not_sent(e):
+            # 接続できていないので、ジョブは作られていない
+            raise
+        # 送信後に切断された場合は Fabric 側で受理済みかもしれないので、再試行させない
+        logging.exception("Fabric notebook trigger outcome is unknown; not retrying.")
+        return
+    except (requests.Timeout, requests.exceptions.ChunkedEncodingError):
+        # 送信後の読み取りタイムアウト等も同様に再試行させない
+        logging.exception("Fabric notebook trigger outcome is unknown; not retrying.")
+        return
+    if resp.status_code in (200, 201, 202):
+        logging.info("Fabric notebook triggered. upstream_status=%s", resp.status_code)
+        return
+
+    if resp.status_code in _AMBIGUOUS_TRIGGER_STATUSES:
+        logging.error(
+            "Fabric notebook trigger outcome is unknown; not retrying. status=%s",
+            resp.status_code,
         )
+        return
+
+    if resp.status_code == 429 or resp.status_code >= 500:
+        raise RuntimeError(
+            f"Failed to trigger Fabric notebook. status={resp.status_code}"
+        )
+    logging.error(
+        "Fabric notebook trigger was rejected. status=%s, body=%s",
+        resp.status_code,
+        resp.text,
+    )
+
+
+# ===== Warmup trigger =====
+
+@app.warm_up_trigger("warmup")
+# WarmUpContext は azure.functions のトップレベルには無いので注釈は付けない（公式サンプルと同じ）
+def warmup(warmup) -> None:
+    """
+    Populate the DB connection and the Fabric token cache before the instance
+    receives HTTP traffic.
+    """
+    logging.info("warmup called")
+
+    try:
+        with _db_cursor() as cursor:
+            cursor.execute("SELECT 1;")
+            cursor.fetchone()
+    except Exception:
+        logging.exception("warmup: DB connection failed")
+
+    if FABRIC_TENANT_ID and FABRIC_CLIENT_ID and FABRIC_CLIENT_SECRET:
+        try:
+            _get_fabric_access_token()
+        except Exception:
+            logging.exception("warmup: failed to obtain Fabric access token")
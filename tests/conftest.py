@@ -0,0 +1,14 @@
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 接続文字列を空にして、import 時に DB へ接続しに行かないようにする
+os.environ.pop("FABRIC_SQL_CONNECTIONSTRING", None)
+
+try:
+    import pypyodbc  # noqa: F401
+except Exception:
+    # unixODBC が無い環境でも function_app を import できるように、空のドライバを差し込む
+    sys.modules["pypyodbc"] = types.ModuleType("pypyodbc")
@@ -0,0 +1,275 @@
+import gzip
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import azure.functions as func
+import orjson
+import pytest
+import requests
+
+import function_app
+
+
+def test_functions_are_indexed():
+    names = {fn.get_function_name() for fn in function_app.app.get_functions()}
+    assert {"get_feature_candidates", "dispatch_fabric_notebook", "warmup"} <= names
+
+
+def test_clamp_limit_handles_oversized_digit_strings():
+    assert function_app._clamp_limit("9" * 5000) == 2000
+    assert function_app._clamp_limit("-" + "9" * 5000) == 1
+    assert function_app._clamp_limit("0000000000005") == 5
+    assert function_app._clamp_limit("abc") == 200
+
+
+def _request(accept_encoding=None):
+    headers = {"Accept-Encoding": accept_encoding} if accept_encoding is not None else {}
+    return func.HttpRequest(method="GET", url="/api/test", headers=headers, body=b"")
+
+
+_LARGE_PAYLOAD = [{"tag_id": f"t{i}", "tag_name": "x" * 20} for i in range(100)]
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        ("gzip, deflate, br", "br"),
+        ("br;q=0, gzip", "gzip"),
+        ("gzip;q=0.0", None),
+        ("br;q=0.5", "br"),
+        (None, None),
+    ],
+)
+def test_json_response_picks_content_encoding(accept_encoding, expected):
+    resp = function_app._json_response(_LARGE_PAYLOAD, req=_request(accept_encoding))
+    assert resp.headers.get("Content-Encoding") == expected
+    assert resp.headers["Vary"] == "Accept-Encoding"
+
+
+def test_json_response_leaves_small_bodies_uncompressed():
+    resp = function_app._json_response({"tag_id": "t1"}, req=_request("br, gzip"))
+    assert len(resp.get_body()) < function_app._COMPRESS_MIN_BYTES
+    assert "Content-Encoding" not in resp.headers
+    assert orjson.loads(resp.get_body()) == {"tag_id": "t1"}
+
+
+def test_json_response_gzip_round_trip():
+    resp = function_app._json_response(_LARGE_PAYLOAD, req=_request("gzip"))
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert orjson.loads(gzip.decompress(resp.get_body())) == _LARGE_PAYLOAD
+
+
+class _TupleRow(tuple):
+    """Stand-in for pypyodbc's TupleRow, which subclasses tuple."""
+
+
+def test_rows_as_arrays_encode_tuple_subclass_rows():
+    cols = ("tag_id", "created_at")
+    rows = [_TupleRow(("t1", datetime(2024, 1, 2, 3, 4, 5)))]
+    assert orjson.loads(function_app._rows_to_json_bytes(cols, rows, as_arrays=True)) == [
+        ["t1", "2024-01-02T03:04:05+00:00"]
+    ]
+    assert orjson.loads(function_app._rows_to_json_bytes(cols, rows)) == [
+        {"tag_id": "t1", "created_at": "2024-01-02T03:04:05+00:00"}
+    ]
+
+
+class _AdoptCursor:
+    def __init__(self, existing):
+        self.existing = existing
+        self.calls = []
+
+    def execute(self, sql, params):
+        self.calls.append((sql, params))
+
+    def fetchall(self):
+        sql, params = self.calls[-1]
+        return [(cid,) for cid in params if cid in self.existing]
+
+
+@pytest.mark.parametrize("count", [1, 3, function_app._ADOPT_MAX_IDS_PER_BATCH + 1])
+def test_bulk_adopt_binds_one_parameter_per_placeholder(monkeypatch, count):
+    ids = [f"c{i}" for i in range(count)]
+    cursor = _AdoptCursor(set(ids[::2]))
+
+    @contextmanager
+    def db_cursor():
+        yield cursor
+
+    monkeypatch.setattr(function_app, "_db_cursor", db_cursor)
+    adopted = function_app._bulk_adopt(ids + ids[:1], datetime(2024, 1, 1))
+
+    assert adopted == set(ids[::2])
+    assert len(cursor.calls) == -(-count // function_app._ADOPT_MAX_IDS_PER_BATCH)
+    for sql, params in cursor.calls:
+        assert sql.count("?") == len(params)
+        assert sql == function_app._adopt_candidates_sql((len(params) - 5) // 4)
+
+
+def _queue_message(payload):
+    return func.QueueMessage(body=orjson.dumps(payload))
+
+
+def _patch_fabric(monkeypatch, post):
+    monkeypatch.setattr(function_app, "FABRIC_WORKSPACE_ID", "w")
+    monkeypatch.setattr(function_app, "FABRIC_ARTIFACT_ID", "a")
+    monkeypatch.setattr(function_app, "_get_fabric_access_token", lambda: "token")
+    monkeypatch.setattr(function_app._HTTP, "post", post)
+
+
+def test_dispatch_does_not_retry_after_read_timeout(monkeypatch):
+    calls = []
+
+    def post(url, **kwargs):
+        calls.append(url)
+        raise requests.ReadTimeout()
+
+    _patch_fabric(monkeypatch, post)
+    function_app.dispatch_fabric_notebook(_queue_message({"sample_size": 1}))
+    assert len(calls) == 1
+
+
+def test_dispatch_retries_when_not_connected(monkeypatch):
+    def post(url, **kwargs):
+        raise requests.ConnectTimeout()
+
+    _patch_fabric(monkeypatch, post)
+    with pytest.raises(requests.ConnectionError):
+        function_app.dispatch_fabric_notebook(_queue_message({"sample_size": 1}))
+
+
+def _serve_once(handle):
+    """Accept one connection on a local port, pass it to handle and return the base URL."""
+    server = socket.create_server(("127.0.0.1", 0))
+
+    def run():
+        with server:
+            conn, _ = server.accept()
+            with conn:
+                handle(conn)
+
+    threading.Thread(target=run, daemon=True).start()
+    return f"http://127.0.0.1:{server.getsockname()[1]}"
+
+
+def _read_request(conn):
+    data = b""
+    while b"\r\n\r\n" not in data:
+        data += conn.recv(65536)
+    head, _, body = data.partition(b"\r\n\r\n")
+    length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+    while len(body) < length:
+        body += conn.recv(65536)
+    return body
+
+
+def _patch_fabric_base(monkeypatch, base_url):
+    monkeypatch.setattr(function_app, "FABRIC_WORKSPACE_ID", "w")
+    monkeypatch.setattr(function_app, "FABRIC_ARTIFACT_ID", "a")
+    monkeypatch.setattr(function_app, "FABRIC_API_BASE", base_url)
+    monkeypatch.setattr(function_app, "_get_fabric_access_token", lambda: "token")
+
+
+def test_dispatch_does_not_retry_when_connection_drops_after_request(monkeypatch):
+    received = []
+    # リクエストを最後まで受け取ってから、応答せずに切断する
+    base_url = _serve_once(lambda conn: received.append(_read_request(conn)))
+    _patch_fabric_base(monkeypatch, base_url)
+
+    function_app.dispatch_fabric_notebook(_queue_message({"sample_size": 1}))
+    assert orjson.loads(received[0]) == {"sample_size": 1}
+
+
+def test_dispatch_retries_when_connection_is_refused(monkeypatch):
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        port = server.getsockname()[1]
+    _patch_fabric_base(monkeypatch, f"http://127.0.0.1:{port}")
+
+    with pytest.raises(requests.ConnectionError):
+        function_app.dispatch_fabric_notebook(_queue_message({"sample_size": 1}))
+
+
+@pytest.mark.parametrize("status, retried", [(502, False), (504, False), (503, True), (429, True)])
+def test_dispatch_retries_only_unambiguous_upstream_errors(monkeypatch, status, retried):
+    def post(url, **kwargs):
+        resp = requests.Response()
+        resp.status_code = status
+        return resp
+
+    _patch_fabric(monkeypatch, post)
+    if retried:
+        with pytest.raises(RuntimeError):
+            function_app.dispatch_fabric_notebook(_queue_message({"sample_size": 1}))
+    else:
+        function_app.dispatch_fabric_notebook(_queue_message({"sample_size": 1}))
+
+
+def test_keyset_pages_cover_rows_with_null_keys():
+    # SQLite も SQL Server と同じく DESC で NULL を最後に並べる
+    keyset = (("updated_at", "updated_at", None), ("score_id", "score_id", None))
+    db = sqlite3.connect(":memory:")
+    db.execute("CREATE TABLE t (updated_at TEXT, score_id TEXT)")
+    db.executemany(
+        "INSERT INTO t VALUES (?, ?)",
+        [("2024-01-02", "s1"), (None, "s2"), ("2024-01-01", "s3"), (None, "s4"), ("2024-01-02", "s5")],
+    )
+    order = "ORDER BY updated_at DESC, score_id DESC"
+    expected = db.execute(f"SELECT updated_at, score_id FROM t {order}").fetchall()
+
+    seen, after = [], None
+    while True:
+        condition, params = function_app._keyset_where(keyset, after)
+        where = f"WHERE {condition}" if condition else ""
+        row = db.execute(f"SELECT updated_at, score_id FROM t {where} {order} LIMIT 1", params).fetchone()
+        if row is None:
+            break
+        seen.append(row)
+        after = list(row)
+    assert seen == expected
+
+
+def test_next_cursor_header_is_exposed_for_cors():
+    assert function_app._next_cursor_headers("abc") == {
+        "Access-Control-Expose-Headers": "X-Next-Cursor",
+        "X-Next-Cursor": "abc",
+    }
+    assert "X-Next-Cursor" not in function_app._next_cursor_headers(None)
+
+
+def test_account_tag_pages_keep_multi_valued_tags():
+    keyset = function_app._KEYSET_ACCOUNT_TAGS
+    db = sqlite3.connect(":memory:")
+    db.execute("CREATE TABLE account_tags (created_at TEXT, account_id TEXT, tag_id TEXT, tag_value TEXT)")
+    # 同じ企業・タグ・時刻に値が 3 つある複数値タグ
+    db.executemany(
+        "INSERT INTO account_tags VALUES (?, ?, ?, ?)",
+        [("2024-01-01", "a1", "t1", value) for value in ("x", "y", "z")] + [("2024-01-01", "a0", "t1", "x")],
+    )
+    select = "SELECT created_at, account_id, tag_id, tag_value FROM account_tags AS at"
+    order = "ORDER BY " + ", ".join(f"{expr} DESC" for _, expr, _ in keyset)
+    expected = db.execute(f"{select} {order}").fetchall()
+
+    seen, after = [], None
+    while True:
+        condition, params = function_app._keyset_where(keyset, after)
+        where = f"WHERE {condition}" if condition else ""
+        rows = db.execute(f"{select} {where} {order} LIMIT 2", params).fetchall()
+        if not rows:
+            break
+        seen += rows
+        after = list(rows[-1])
+    assert seen == expected
+
+
+def test_cursor_with_non_scalar_key_is_rejected():
+    cursor = function_app._encode_cursor(["2024-01-01T00:00:00", {"a": 1}])
+    req = func.HttpRequest(method="GET", url="/api/getTagDefinitions", params={"cursor": cursor}, body=b"")
+    with pytest.raises(ValueError):
+        function_app._parse_cursor(req, function_app._KEYSET_TAG_DEFINITIONS)
+
+    resp = function_app.get_tag_definitions(req)
+    assert resp.status_code == 400
+    assert orjson.loads(resp.get_body()) == {"message": "Invalid cursor."}